@@ -54,7 +54,7 @@ for C_exp in np.linspace(5.25, 6.75, 7):
                 print("Kernels loaded")
                 print("Average: ", torch.mean(K))
 
-                K = K[permutation][:, permutation]
+                K = K.index_select(0, permutation).index_select(1, permutation)
 
                 K_train_train = K[:n_train, :n_train]
                 K_validation_train = K[n_train:n_train+n_validation, :n_train]
@@ -11,7 +11,7 @@ from equistore import Labels
 from rascaline import SphericalExpansion
 
 from utils.clebsch_gordan import ClebschGordan
-from utils.wigner_kernels import WignerKernelFullIterations, WignerKernelReducedCost, compute_kernel
+from utils.wigner_kernels import WignerKernelFullIterations, WignerKernelReducedCost, compute_kernel, compile_model
 from utils.dataset_processing import get_dataset_slice, get_composition_features, move_to_torch
 from utils.error_measures import get_sse, get_rmse, get_mae, get_sae
 from utils.validation import ValidationCycle
@@ -44,7 +44,14 @@ if optimization_mode != "full" and optimization_mode != "kernel_exp": raise NotI
 if optimization_mode == "kernel_exp" and L_NU != 0: print("WARNING: Cannot interpret final kernel as a kernel exponential")
 cg_mode = "reduced"
 
-if DTYPE == "double": torch.set_default_dtype(torch.float64)
+if DTYPE == "double":
+    torch.set_default_dtype(torch.float64)
+else:
+    # See run_wk.py: single precision propagates through the CG buffers and
+    # kernel intermediates, and TF32 is allowed for the dense matmuls.
+    torch.set_default_dtype(torch.float32)
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
 
 HARTREE_TO_EV = 27.211386245988
 HARTREE_TO_KCALMOL = 627.5
@@ -139,7 +146,7 @@ if L_NU == 0.0:
         model = WignerKernelFullIterations(clebsch, L_MAX, NU_MAX)
     else:
         model = WignerKernelReducedCost(clebsch, L_MAX, NU_MAX)
-    model = model.to(DEVICE)
+    model = compile_model(model.to(DEVICE))
 
     print("Computing train-test-kernels", flush = True)
     test_train_kernel[:, :, 1:NU_MAX+1] = compute_kernel(model, test_coefs, train_coefs, batch_size = BATCH_SIZE, device = DEVICE)
@@ -199,7 +206,7 @@ else:
             model = WignerKernelFullIterations(clebsch, L_MAX, nu)
         else:
             model = WignerKernelReducedCost(clebsch, L_MAX, nu)
-        model = model.to(DEVICE)
+        model = compile_model(model.to(DEVICE))
 
         print("Computing train-test-kernels", flush = True)
         test_train_kernel[:, :, nu] = compute_kernel(model, test_coefs, train_coefs, batch_size = BATCH_SIZE, device = DEVICE)[nu-1]
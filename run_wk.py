@@ -11,7 +11,7 @@ from equistore import Labels
 from rascaline import SphericalExpansion
 
 from utils.clebsch_gordan import ClebschGordan
-from utils.wigner_kernels import WignerKernelFullIterations, WignerKernelReducedCost, compute_kernel
+from utils.wigner_kernels import WignerKernelFullIterations, WignerKernelReducedCost, compute_kernel, compile_model
 from utils.dataset_processing import get_dataset_slice, get_composition_features, move_to_torch
 from utils.error_measures import get_sse, get_rmse, get_mae, get_sae
 from utils.validation import ValidationCycle
@@ -79,7 +79,16 @@ if optimization_mode == "kernel_exp" and L_NU != 0: print("WARNING: Cannot inter
 cg_mode = param_dict["cg mode"]
 
 
-if DTYPE == "double": torch.set_default_dtype(torch.float64)
+if DTYPE == "double":
+    torch.set_default_dtype(torch.float64)
+else:
+    # Single precision: the Clebsch-Gordan buffers and all kernel
+    # intermediates follow the default dtype, and the dense matmul stages may
+    # use TF32 tensor cores. The final regression solve stays in the same
+    # dtype, so use double for production accuracy numbers.
+    torch.set_default_dtype(torch.float32)
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
 np.random.seed(RANDOM_SEED)
 
 HARTREE_TO_EV = 27.211386245988
@@ -188,7 +197,7 @@ if L_NU == 0.0:
         model = WignerKernelFullIterations(clebsch, L_MAX, NU_MAX, DEVICE)
     else:
         model = WignerKernelReducedCost(clebsch, L_MAX, NU_MAX, DEVICE)
-    model = model.to(DEVICE)
+    model = compile_model(model.to(DEVICE))
 
     print("Computing train-train-kernels", flush = True)
     train_train_kernel[:, :, 1:NU_MAX+1] = compute_kernel(model, train_coefs, train_coefs, batch_size = BATCH_SIZE, device = DEVICE)
@@ -250,7 +259,7 @@ else:
             model = WignerKernelFullIterations(clebsch, L_MAX, nu, DEVICE)
         else:
             model = WignerKernelReducedCost(clebsch, L_MAX, nu, DEVICE)
-        model = model.to(DEVICE)
+        model = compile_model(model.to(DEVICE))
 
         print("Computing train-train-kernels", flush = True)
         train_train_kernel[:, :, nu] = compute_kernel(model, train_coefs, train_coefs, batch_size = BATCH_SIZE, device = DEVICE)[nu-1]
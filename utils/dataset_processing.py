@@ -57,10 +57,11 @@ def get_dataset_slice(dataset_path, train_slice, test_slice):
 
 def get_composition_features(frames, all_species):
     species_dict = {s: i for i, s in enumerate(all_species)}
-    data = torch.zeros((len(frames), len(species_dict)))
+    all_species = np.asarray(all_species)  # sorted by the callers
+    counts = np.zeros((len(frames), len(all_species)))
     for i, f in enumerate(frames):
-        for s in f.numbers:
-            data[i, species_dict[s]] += 1
+        counts[i] = np.bincount(np.searchsorted(all_species, f.numbers), minlength=len(all_species))
+    data = torch.tensor(counts, dtype=torch.get_default_dtype())
     properties = Labels(
         names=["atomic_number"],
         values=np.array(list(species_dict.keys()), dtype=np.int32).reshape(
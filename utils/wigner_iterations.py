@@ -4,6 +4,38 @@ import numpy as np
 import tqdm
 import sparse_accumulation
 
+try:
+    import triton
+    import triton.language as tl
+    HAS_TRITON = True
+except ImportError:
+    HAS_TRITON = False
+
+if HAS_TRITON:
+    @triton.jit
+    def _wigner_combine_kernel(X1_ptr, X2_ptr, out_ptr,
+                               m1_ptr, m2_ptr, mult_ptr, lane_offsets_ptr,
+                               x1_stride, x2_stride, out_stride, n_samples,
+                               BLOCK_B: tl.constexpr):
+        # One program per (output lane, block of samples). The gather indices,
+        # multipliers and accumulator stay in registers, so X1/X2 are read and
+        # the result is written exactly once instead of the three memory-bound
+        # passes (two gathers + index_add_) of the eager path.
+        lane = tl.program_id(0)
+        rows = tl.program_id(1) * BLOCK_B + tl.arange(0, BLOCK_B)
+        row_mask = rows < n_samples
+        start = tl.load(lane_offsets_ptr + lane)
+        end = tl.load(lane_offsets_ptr + lane + 1)
+        acc = tl.zeros([BLOCK_B], dtype = X1_ptr.dtype.element_ty)
+        for k in range(start, end):
+            m1 = tl.load(m1_ptr + k)
+            m2 = tl.load(m2_ptr + k)
+            multiplier = tl.load(mult_ptr + k)
+            x1 = tl.load(X1_ptr + rows * x1_stride + m1, mask = row_mask, other = 0.0)
+            x2 = tl.load(X2_ptr + rows * x2_stride + m2, mask = row_mask, other = 0.0)
+            acc += x1 * x2 * multiplier
+        tl.store(out_ptr + rows * out_stride + lane, acc, mask = row_mask)
+
 def multiply(first, second, multiplier):
     return [first[0], second[0], first[1] * second[1] * multiplier]
 
@@ -33,22 +65,23 @@ def get_conversion(l, m):
     return X_re, X_im
 
 def compress(sequence, epsilon = 1e-15):
-    result = []
-    for i in range(len(sequence)):
-        m1, m2, multiplier = sequence[i][0], sequence[i][1], sequence[i][2]
-        already = False
-        for j in range(len(result)):
-            if (m1 == result[j][0]) and (m2 == result[j][1]):
-                already = True
-                break
-                
-        if not already:
-            multiplier = 0.0
-            for j in range(i, len(sequence)):
-                if (m1 == sequence[j][0]) and (m2 == sequence[j][1]):
-                    multiplier += sequence[j][2]
-            if (np.abs(multiplier) > epsilon):
-                result.append([m1, m2, multiplier])
+    # Sums the multipliers of duplicate (m1, m2) pairs with a single sort+reduce
+    # instead of quadratic membership checks; this is called for every
+    # (l1, l2, lambda, mu) combination during module construction.
+    if len(sequence) == 0:
+        return []
+    arr = np.asarray(sequence)
+    m1, m2 = arr[:, 0].astype(int), arr[:, 1].astype(int)
+    multipliers = arr[:, 2]
+    keys = m1 * (m2.max() + 1) + m2  # m1 and m2 are shifted indices, always >= 0
+    order = np.argsort(keys, kind = 'stable')
+    sorted_keys = keys[order]
+    boundaries = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sums = np.add.reduceat(multipliers[order], boundaries)
+    first_occurrences = order[boundaries]
+    keep = np.abs(sums) > epsilon
+    result = [[int(m1[i]), int(m2[i]), multiplier]
+              for i, multiplier in zip(first_occurrences[keep], sums[keep])]
     #print(len(sequence), '->', len(result))
     return result
 
@@ -142,7 +175,24 @@ class WignerCombiningSingleUnrolled(torch.nn.Module):
             
             self.register_buffer('multiplier_total_aligned',
                                 torch.tensor(multiplier_total_aligned).type(torch.get_default_dtype()))
-            
+
+            # Many (m1, m1p, m2, m2p) combinations repeat across output lanes;
+            # gather each unique combination only once and fold the per-lane
+            # multipliers into a dense (K_unique, (2*lambd+1)^2) coefficient
+            # matrix, so the vectorized path is a deduplicated gather followed
+            # by a single matmul instead of an index_add_ scatter.
+            quadruples = np.stack([m1_aligned, m1p_aligned, m2_aligned, m2p_aligned], axis = 1)
+            unique_quadruples, inverse = np.unique(quadruples, axis = 0, return_inverse = True)
+            coefficient_matrix = np.zeros((len(unique_quadruples), (2 * self.lambd + 1) ** 2))
+            np.add.at(coefficient_matrix, (inverse, np.array(mu_both_aligned)),
+                      np.array(multiplier_total_aligned))
+            self.register_buffer('m1_unique', torch.LongTensor(unique_quadruples[:, 0]))
+            self.register_buffer('m1p_unique', torch.LongTensor(unique_quadruples[:, 1]))
+            self.register_buffer('m2_unique', torch.LongTensor(unique_quadruples[:, 2]))
+            self.register_buffer('m2p_unique', torch.LongTensor(unique_quadruples[:, 3]))
+            self.register_buffer('coefficient_matrix',
+                                torch.tensor(coefficient_matrix).type(torch.get_default_dtype()))
+
             # Create indices for fast CG iterations:
             m1_fast = (2*self.l1+1)*self.m1_aligned+self.m1p_aligned
             m2_fast = (2*self.l2+1)*self.m2_aligned+self.m2p_aligned
@@ -155,6 +205,15 @@ class WignerCombiningSingleUnrolled(torch.nn.Module):
             self.mu_fast = mu_fast[sort_indices].to(device)
             self.multipliers_fast = self.multiplier_total_aligned[sort_indices].to(device)
 
+            # Segment boundaries of each output lane within the mu-sorted
+            # arrays above, for the fused Triton kernel:
+            lane_counts = torch.bincount(self.mu_fast.cpu(), minlength = (2 * self.lambd + 1) ** 2)
+            lane_offsets = torch.cat(
+                [torch.zeros(1, dtype = torch.long), torch.cumsum(lane_counts, dim = 0)])
+            self.lane_offsets_cpu = lane_offsets.tolist()
+            self.lane_offsets = lane_offsets.to(device)
+            self.max_lane_width = int(lane_counts.max())
+
         if algorithm == "dense":
 
             dense_transformation = torch.zeros((2*self.l1+1, 2*self.l2+1, 2*self.lambd+1), dtype=torch.get_default_dtype(), device=device)
@@ -176,34 +235,69 @@ class WignerCombiningSingleUnrolled(torch.nn.Module):
             X1 = X1.reshape(-1, 1, (2*self.l1+1)**2)
             X2 = X2.reshape(-1, 1, (2*self.l2+1)**2)
             result = sparse_accumulation.accumulate(X1, X2, self.mu_fast, (2*self.lambd+1)**2, self.m1_fast, self.m2_fast, self.multipliers_fast)
-            if torch.allclose(result, torch.zeros_like(result)) and device.type == "cuda":
+            # The overflow check can only trigger on CUDA; checking the device
+            # first avoids a full reduction (and host synchronization) on
+            # every CPU call.
+            if device.type == "cuda" and torch.allclose(result, torch.zeros_like(result)):
                 raise ValueError(f"You probably overflowed the GPU's cache. l1={self.l1}, l2={self.l2}, lambda={self.lambd}")
             return result.reshape(-1, 2*self.lambd+1, 2*self.lambd+1)
 
         if algorithm_now == 'dense':
-            product = torch.einsum("iab, icd -> iacbd", X1, X2)
-            result = product.reshape((product.shape[0], (2*self.l1+1)*(2*self.l2+1), (2*self.l1+1)*(2*self.l2+1)))
-            result = result @ self.dense_transformation
-            result = result.swapaxes(1, 2)
-            result = result @ self.dense_transformation
-            result = result.swapaxes(1, 2)
+            # Chained pairwise contractions; the full (2l1+1)(2l2+1) x
+            # (2l1+1)(2l2+1) Cartesian product of X1 and X2 is never
+            # materialized.
+            transformation = self.dense_transformation.reshape(
+                2*self.l1+1, 2*self.l2+1, 2*self.lambd+1)
+            partial = torch.einsum("iab, acm -> ibcm", X1, transformation)
+            partial = torch.einsum("ibcm, icd -> ibdm", partial, X2)
+            result = torch.einsum("ibdm, bdn -> imn", partial, transformation)
 
             return result
         
         if algorithm_now == 'vectorized':
-            contributions = X1[:, self.m1_aligned, self.m1p_aligned] * X2[:, self.m2_aligned, self.m2p_aligned] \
-                            * self.multiplier_total_aligned
-            result = torch.zeros([X1.shape[0], (2 * self.lambd + 1) ** 2], device = device)
-            result.index_add_(1, self.mu_both_aligned, contributions)
-            return result[:, self.mu_both]
+            if HAS_TRITON and device.type == 'cuda':
+                n_samples = X1.shape[0]
+                n_lanes = (2 * self.lambd + 1) ** 2
+                X1_flat = X1.reshape(n_samples, -1).contiguous()
+                X2_flat = X2.reshape(n_samples, -1).contiguous()
+                result = torch.empty(n_samples, n_lanes, device = device, dtype = X1.dtype)
+                BLOCK_B = 128
+                grid = (n_lanes, triton.cdiv(n_samples, BLOCK_B))
+                _wigner_combine_kernel[grid](
+                    X1_flat, X2_flat, result,
+                    self.m1_fast, self.m2_fast, self.multipliers_fast, self.lane_offsets,
+                    X1_flat.stride(0), X2_flat.stride(0), result.stride(0), n_samples,
+                    BLOCK_B = BLOCK_B)
+                # mu_both enumerates the (mu, mup) lanes in row-major order, so
+                # unflattening them is a free reshape rather than a gather.
+                return result.reshape(-1, 2 * self.lambd + 1, 2 * self.lambd + 1)
+            products = X1[:, self.m1_unique, self.m1p_unique] * X2[:, self.m2_unique, self.m2p_unique]
+            result = products @ self.coefficient_matrix
+            # Same row-major lane layout as above: reshape instead of a gather.
+            return result.reshape(-1, 2 * self.lambd + 1, 2 * self.lambd + 1)
            
         if algorithm_now == 'loops':
+            # One vectorized gather + reduction per (mu, mup) lane, using the
+            # mu-sorted index arrays; the former quadruple Python loop over
+            # individual terms spent nearly all its time in the interpreter.
+            X1_flat = X1.reshape(X1.shape[0], -1)
+            X2_flat = X2.reshape(X2.shape[0], -1)
             result = torch.zeros([X1.shape[0], 2 * self.lambd + 1, 2 * self.lambd + 1], device = device)
-            for mu in range(0, 2 * self.lambd + 1):
-                for m1, m2, multiplier in self.transformation[mu]:
-                    for mup in range(0, 2 * self.lambd + 1):
-                        for m1p, m2p, multiplierp in self.transformation[mup]:
-                            result[:, mu, mup] += X1[:, m1, m1p] * X2[:, m2, m2p] * multiplier * multiplierp
+            result_flat = result.reshape(X1.shape[0], -1)
+            # Two gather buffers reused across lanes; index_select with out=
+            # plus the in-place multiply keep the loop free of per-lane
+            # temporaries except for the small reduction output.
+            gathered_1 = torch.empty(X1.shape[0], self.max_lane_width, device = device, dtype = X1.dtype)
+            gathered_2 = torch.empty_like(gathered_1)
+            for lane in range((2 * self.lambd + 1) ** 2):
+                start, end = self.lane_offsets_cpu[lane], self.lane_offsets_cpu[lane + 1]
+                if start == end:
+                    continue
+                contributions = gathered_1[:, :end - start]
+                torch.index_select(X1_flat, 1, self.m1_fast[start:end], out = contributions)
+                torch.index_select(X2_flat, 1, self.m2_fast[start:end], out = gathered_2[:, :end - start])
+                contributions *= gathered_2[:, :end - start]
+                result_flat[:, lane] = contributions @ self.multipliers_fast[start:end]
 
             return result
     
@@ -216,6 +310,7 @@ class WignerCombiningUnrolled(torch.nn.Module):
         self.algorithm = algorithm
         self.device = device
         self.lambd_max = lambd_max
+        self._schedule_cache = {}
         self.single_combiners = torch.nn.ModuleDict()
         for l1 in range(clebsch.shape[0]):
             for l2 in range(clebsch.shape[1]):
@@ -227,21 +322,130 @@ class WignerCombiningUnrolled(torch.nn.Module):
 
                     self.single_combiners[key] = WignerCombiningSingleUnrolled(
                         clebsch[l1, l2, lambd, :2 * l1 + 1, :2 * l2 + 1], lambd, algorithm = self.algorithm, device = self.device)
-                
-    def forward(self, X1, X2):
-        result = {}
+
+        if algorithm == 'dense':
+            # All lambda channels of a given (l1, l2) consume the same outer
+            # product of X1 and X2, and their first transformation stages can
+            # run as one matmul against the concatenated dense transformations
+            # instead of one micro-launch per lambda.
+            self.dense_groups = {}
+            for l1 in range(clebsch.shape[0]):
+                for l2 in range(clebsch.shape[1]):
+                    lambd_list = list(range(abs(l1 - l2), min(l1 + l2, self.lambd_max) + 1))
+                    if len(lambd_list) == 0:
+                        continue
+                    transformations = [self.single_combiners['{}_{}_{}'.format(l1, l2, lambd)].dense_transformation
+                                       for lambd in lambd_list]
+                    widths = [transformation.shape[1] for transformation in transformations]
+                    self.dense_groups['{}_{}'.format(l1, l2)] = (
+                        lambd_list,
+                        widths,
+                        torch.cat(transformations, dim = 1).reshape(2*l1+1, 2*l2+1, sum(widths)),
+                        [transformation.reshape(2*l1+1, 2*l2+1, -1) for transformation in transformations])
+
+        if algorithm == 'vectorized':
+            # The lambda channels of a given (l1, l2) gather largely
+            # overlapping (m1, m1p, m2, m2p) products of X1 and X2. Take the
+            # union of the per-channel index sets and concatenate the
+            # coefficient matrices, so each product is gathered once and all
+            # channels are reduced by a single matmul.
+            self.vectorized_groups = {}
+            for l1 in range(clebsch.shape[0]):
+                for l2 in range(clebsch.shape[1]):
+                    lambd_list = list(range(abs(l1 - l2), min(l1 + l2, self.lambd_max) + 1))
+                    if len(lambd_list) == 0:
+                        continue
+                    combiners = [self.single_combiners['{}_{}_{}'.format(l1, l2, lambd)]
+                                 for lambd in lambd_list]
+                    quadruples = [np.stack([combiner.m1_unique.numpy(), combiner.m1p_unique.numpy(),
+                                            combiner.m2_unique.numpy(), combiner.m2p_unique.numpy()], axis = 1)
+                                  for combiner in combiners]
+                    union, inverse = np.unique(np.concatenate(quadruples, axis = 0), axis = 0,
+                                               return_inverse = True)
+                    widths = [(2 * lambd + 1) ** 2 for lambd in lambd_list]
+                    joint_coefficients = torch.zeros(len(union), sum(widths),
+                                                     dtype = torch.get_default_dtype())
+                    row_offset, lane_offset = 0, 0
+                    for combiner, channel_quadruples, width in zip(combiners, quadruples, widths):
+                        rows = torch.LongTensor(inverse[row_offset:row_offset + channel_quadruples.shape[0]])
+                        joint_coefficients[rows, lane_offset:lane_offset + width] = combiner.coefficient_matrix
+                        row_offset += channel_quadruples.shape[0]
+                        lane_offset += width
+                    self.vectorized_groups['{}_{}'.format(l1, l2)] = (
+                        lambd_list,
+                        widths,
+                        torch.LongTensor(union[:, 0]).to(device),
+                        torch.LongTensor(union[:, 1]).to(device),
+                        torch.LongTensor(union[:, 2]).to(device),
+                        torch.LongTensor(union[:, 3]).to(device),
+                        joint_coefficients.to(device))
+
+    def accumulate(self, result, out_key, contribution):
+        if out_key not in result:
+            result[out_key] = contribution
+        else:
+            result[out_key] += contribution
+
+    def get_schedule(self, X1, X2):
+        # The same few key sets are seen over and over across batch tiles, so
+        # the key parsing and output-key formatting of the combining loop are
+        # memoized per (X1 keys, X2 keys) pair.
+        cache_key = (tuple(X1.keys()), tuple(X2.keys()))
+        if cache_key in self._schedule_cache:
+            return self._schedule_cache[cache_key]
+        schedule = []
         for key1 in X1.keys():
             for key2 in X2.keys():
                 l1 = int(key1.split("_")[0])
                 l2 = int(key2.split("_")[0])
                 sigma1 = int(key1.split("_")[1])
                 sigma2 = int(key2.split("_")[1])
+                channels = []
                 for lambd in range(abs(l1 - l2), min(l1 + l2, self.lambd_max) + 1):
-                    sigma = sigma1 * sigma2 * (-1)**(l1+l2+lambd)                   
-                    combiner = self.single_combiners['{}_{}_{}'.format(l1, l2, lambd)] 
-                    #print("Calling combiner on", '{}_{}_{}'.format(l1, l2, lambd))
-                    if str(lambd) + "_" + str(sigma) not in result.keys():
-                        result[str(lambd) + "_" + str(sigma)] = combiner(X1[key1], X2[key2])
-                    else:
-                        result[str(lambd) + "_" + str(sigma)] += combiner(X1[key1], X2[key2])
+                    sigma = sigma1 * sigma2 * (-1)**(l1+l2+lambd)
+                    channels.append((lambd, str(lambd) + "_" + str(sigma),
+                                     self.single_combiners['{}_{}_{}'.format(l1, l2, lambd)]))
+                if not channels:
+                    # |l1 - l2| > lambd_max contributes nothing (and has no
+                    # dense/vectorized group), so keep it out of the schedule.
+                    continue
+                schedule.append((key1, key2, '{}_{}'.format(l1, l2), channels))
+        self._schedule_cache[cache_key] = schedule
+        return schedule
+
+    def forward(self, X1, X2):
+        result = {}
+        for key1, key2, group_key, channels in self.get_schedule(X1, X2):
+            if self.algorithm == 'dense':
+                if not channels:
+                    # |l1 - l2| > lambd_max: no output channels and no group
+                    # was built for this pair.
+                    continue
+                lambd_list, widths, joint_transformation, transformations = \
+                    self.dense_groups[group_key]
+                # As in the single-combiner dense path, chained pairwise
+                # contractions avoid materializing the Cartesian product.
+                partial = torch.einsum("iab, acw -> ibcw", X1[key1], joint_transformation)
+                partial = torch.einsum("ibcw, icd -> ibdw", partial, X2[key2])
+                pieces = torch.split(partial, widths, dim = 3)
+                for (lambd, out_key, combiner), piece, transformation in \
+                        zip(channels, pieces, transformations):
+                    contribution = torch.einsum("ibdw, bdp -> iwp", piece, transformation)
+                    self.accumulate(result, out_key, contribution)
+                continue
+            if self.algorithm == 'vectorized' and not (HAS_TRITON and X1[key1].is_cuda):
+                if not channels:
+                    # Same as the dense path: no channels, no group.
+                    continue
+                lambd_list, widths, m1_u, m1p_u, m2_u, m2p_u, joint_coefficients = \
+                    self.vectorized_groups[group_key]
+                products = X1[key1][:, m1_u, m1p_u] * X2[key2][:, m2_u, m2p_u]
+                combined = products @ joint_coefficients
+                pieces = torch.split(combined, widths, dim = 1)
+                for (lambd, out_key, combiner), piece in zip(channels, pieces):
+                    self.accumulate(result, out_key,
+                                    piece.reshape(-1, 2 * lambd + 1, 2 * lambd + 1))
+                continue
+            for lambd, out_key, combiner in channels:
+                self.accumulate(result, out_key, combiner(X1[key1], X2[key2]))
         return result
@@ -15,18 +15,19 @@ def initialize_wigner_single_l(first, second):
     result = result.reshape(first_b_size, first_m_size, second_b_size, second_m_size)
     return result.transpose(1, 2)
 
-def initialize_wigner_single_species_batched(first, second, center_species, idx_1, idx_2):
+def initialize_wigner_single_species_batched(first_blocks, second_blocks, idx_1, idx_2):
     """
-    Evaluates the nu=1 Wigner kernels for a single species.
+    Evaluates the nu=1 Wigner kernels for a single species. The per-l block
+    values are extracted once per species by the caller so that the batched
+    loops do not repeat the TensorMap lookups.
     """
     idx_1_begin, idx_1_end = idx_1
     idx_2_begin, idx_2_end = idx_2
-    lmax = np.max(first.keys["spherical_harmonics_l"])
     result = {}
-    for l in range(lmax+1):
+    for l, (first_values, second_values) in enumerate(zip(first_blocks, second_blocks)):
         result[str(l) + "_" + str(1)] = ((8.0*np.pi**2)/(2*l+1))*initialize_wigner_single_l(
-                first.block(spherical_harmonics_l=l, species_center=center_species).values[idx_1_begin:idx_1_end, :, :], 
-                second.block(spherical_harmonics_l=l, species_center=center_species).values[idx_2_begin:idx_2_end, :, :]
+                first_values[idx_1_begin:idx_1_end, :, :],
+                second_values[idx_2_begin:idx_2_end, :, :]
                 )
     return result
 
@@ -95,6 +96,66 @@ class WignerKernelReducedCost(torch.nn.Module):
         result = torch.cat(result, dim = -1)
         return result
 
+class CUDAGraphRunner:
+    """
+    Captures the kernel model evaluation into a CUDA graph on the first
+    full-size batch and replays it for every following batch with the same
+    shapes, removing the per-batch launch overhead of the many small combining
+    kernels. Ragged (tail) batches and failed captures fall back to eager
+    execution; the returned tensor is only valid until the next call.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.graph = None
+        self.signature = None
+        self.static_inputs = None
+        self.static_output = None
+        self.failed = False
+
+    def __call__(self, X):
+        signature = tuple((key, tuple(value.shape)) for key, value in sorted(X.items()))
+        if self.failed or not all(value.is_cuda for value in X.values()):
+            return self.model(X)
+        if self.graph is not None:
+            if signature != self.signature:  # ragged tail batch
+                return self.model(X)
+            for key, value in X.items():
+                self.static_inputs[key].copy_(value)
+            self.graph.replay()
+            return self.static_output
+        try:
+            self.static_inputs = {key: value.clone() for key, value in X.items()}
+            # Warm up on a side stream before capturing, as the CUDA graphs
+            # documentation recommends:
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                self.model(self.static_inputs)
+            torch.cuda.current_stream().wait_stream(stream)
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph):
+                self.static_output = self.model(self.static_inputs)
+            self.signature = signature
+            self.graph.replay()
+            return self.static_output
+        except Exception as e:
+            print(f"WARNING: CUDA graph capture failed ({e}), running eagerly", flush = True)
+            self.failed = True
+            self.graph = None
+            return self.model(X)
+
+def compile_model(model):
+    """
+    Wraps a Wigner kernel model with torch.compile when available, so that the
+    many small operations of the combining loops are fused ahead of the batched
+    kernel evaluation. Unsupported constructs fall back to eager execution.
+    """
+    if not hasattr(torch, "compile"):
+        return model
+    import torch._dynamo
+    torch._dynamo.config.suppress_errors = True
+    return torch.compile(model)
+
 def compute_kernel(model, first, second, batch_size = 1000, device = 'cpu'):
     """
     Concatenates invariant Wigner kernels of different body orders and sums them over atoms in the same structure.
@@ -111,8 +172,20 @@ def compute_kernel(model, first, second, batch_size = 1000, device = 'cpu'):
             [second.block(spherical_harmonics_l=0, species_center=center_species).samples["structure"] for center_species in second.keys["species_center"].values[:, 0]]
             )))
     
-    wigner_invariants = torch.zeros((n_first, n_second, nu_max), device=device)
+    # Accumulated in transposed (second, first) layout so that both scatter
+    # accumulations below run along dim 0, where index_add_ writes whole
+    # contiguous rows; a dim=1 index_add_ would scatter strided columns.
+    wigner_invariants = torch.zeros((n_second, n_first, nu_max), device=device)
     batch_size_each = int(np.sqrt(batch_size))  # A batch size for each of the two tensor maps involved.
+
+    # Persistent scratch buffer for the per-batch structure accumulation;
+    # allocating it once avoids hitting the allocator for every batch pair.
+    scratch = torch.zeros((n_first, batch_size_each, nu_max), device=device)
+
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        model_caller = CUDAGraphRunner(model)
+    else:
+        model_caller = model
   
     for center_species in all_species:
         # if center_species == 1: continue  # UNCOMMENT FOR METHANE DATASET C-ONLY VERSION
@@ -130,6 +203,14 @@ def compute_kernel(model, first, second, batch_size = 1000, device = 'cpu'):
         len_first = structures_first.shape[0]
         len_second = structures_second.shape[0]
 
+        # Extract the per-l block values for this species once, outside of the
+        # batched loops below:
+        lmax = np.max(first.keys["spherical_harmonics_l"])
+        first_blocks = [first.block(spherical_harmonics_l=l, species_center=center_species).values
+                        for l in range(lmax+1)]
+        second_blocks = [second.block(spherical_harmonics_l=l, species_center=center_species).values
+                         for l in range(lmax+1)]
+
         # Batched calculation, starting from nu = 1 kernel initialization:
         for idx_1_begin in tqdm.tqdm(range(0, len_first, batch_size_each)):
             idx_1_end = min(idx_1_begin+batch_size_each, len_first)
@@ -140,24 +221,29 @@ def compute_kernel(model, first, second, batch_size = 1000, device = 'cpu'):
                 dimension_2 = idx_2_end - idx_2_begin
 
                 wigner_c = initialize_wigner_single_species_batched(
-                    first,
-                    second, 
-                    center_species,
+                    first_blocks,
+                    second_blocks,
                     (idx_1_begin, idx_1_end),
                     (idx_2_begin, idx_2_end),
-                )            
+                )
 
                 for key in wigner_c.keys():
-                    wigner_c[key] = wigner_c[key].reshape([dimension_1*dimension_2, wigner_c[key].shape[2], wigner_c[key].shape[3]])               
-                now = {}
-                for key in wigner_c.keys():
-                    now[key] = wigner_c[key]
-                result_now = model(now)
+                    wigner_c[key] = wigner_c[key].reshape([dimension_1*dimension_2, wigner_c[key].shape[2], wigner_c[key].shape[3]])
+                # Kernel evaluation never needs gradients (the models only
+                # hold precomputed buffers), so keep autograd out of it:
+                with torch.no_grad():
+                    result_now = model_caller(wigner_c)
+                # Release the nu = 1 kernels of this tile right away: they are
+                # the largest per-tile tensors, and freeing them before the
+                # accumulation below lowers the peak memory per batch, which
+                # is what limits batch_size.
+                del wigner_c
                 result_now = result_now.reshape([dimension_1, dimension_2, nu_max])
 
-                temp = torch.zeros((wigner_invariants.shape[0], result_now.shape[1], nu_max), device = result_now.device)
+                temp = scratch[:, :dimension_2]
+                temp.zero_()
                 temp.index_add_(dim=0, index=structures_first[idx_1_begin:idx_1_end], source=result_now)
-                wigner_invariants.index_add_(dim=1, index=structures_second[idx_2_begin:idx_2_end], source=temp)
+                wigner_invariants.index_add_(dim=0, index=structures_second[idx_2_begin:idx_2_end], source=temp.swapaxes(0, 1))
 
                 """
                 # Old (and slow) version
@@ -165,4 +251,4 @@ def compute_kernel(model, first, second, batch_size = 1000, device = 'cpu'):
                     for i_2 in range(idx_2_begin, idx_2_end):
                         wigner_invariants[structures_first[i_1], structures_second[i_2]] += result_now[i_1-idx_1_begin, i_2-idx_2_begin]
                 """
-    return wigner_invariants
+    return wigner_invariants.swapaxes(0, 1)